@@ -1,9 +1,8 @@
 import streamlit as st
-import psycopg
+from psycopg_pool import ConnectionPool
 import os
-import math
+import hashlib
 import logging
-import tempfile
 from typing import Optional, Dict
 
 # IMPORTACIÓN DEL MOTOR DE INTELIGENCIA (NUEVO)
@@ -41,24 +40,60 @@ def get_db_config() -> Dict[str, str]:
 
 DB_CONFIG = get_db_config()
 
+@st.cache_resource
+def get_db_pool() -> Optional[ConnectionPool]:
+    # Un solo pool por proceso: sobrevive a reruns y se comparte entre sesiones
+    if not DB_CONFIG: return None
+    # open=True explícito: el valor implícito está deprecado y pasará a False en psycopg-pool
+    return ConnectionPool(kwargs=DB_CONFIG, min_size=1, max_size=4, timeout=5.0, open=True)
+
 # ==========================================
 # 3. UTILERÍAS
 # ==========================================
+@st.cache_data(ttl=30)
 def get_db_status() -> int:
-    if not DB_CONFIG: return -1
+    pool = get_db_pool()
+    if pool is None: return -1
     try:
-        with psycopg.connect(**DB_CONFIG) as conn:
+        with pool.connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT count(*) FROM tbl_entradas_raw;")
-                return int(cur.fetchone()[0])
+                # Estimación O(1) del planner (pg_class.reltuples) en lugar de count(*)
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'tbl_entradas_raw'::regclass;")
+                estimate = int(cur.fetchone()[0])
+                if estimate >= 0: return estimate
+
+                # -1 = tabla aún sin VACUUM/ANALYZE, caso normal justo después de la carga COPY
+                # del seeder (hasta que corre autoanalyze). El contador de filas vivas del
+                # collector de estadísticas se actualiza al confirmar y también es O(1).
+                cur.execute("SELECT n_live_tup FROM pg_stat_user_tables WHERE relid = 'tbl_entradas_raw'::regclass;")
+                row = cur.fetchone()
+                return int(row[0]) if row and row[0] is not None else 0
     except Exception as e:
         logger.error(f"DB Error: {e}")
         return -1
 
+class EvidenceProcessingError(Exception):
+    # Transporta la respuesta fallida del core fuera de la función memoizada
+    def __init__(self, result: Dict):
+        super().__init__(result.get("error_msg"))
+        self.result = result
+
+@st.cache_data(ttl=3600, max_entries=100, show_spinner=False)
+def process_evidence(content_key: str, _job_payload: Dict) -> Dict:
+    # Memoizado por contenido: solo 'content_key' (BLAKE2b del archivo) forma la llave;
+    # el payload (prefijo '_') no se hashea. Re-subir la misma evidencia no re-ejecuta OCR.
+    result = document_full_processor(_job_payload)
+    # Solo se memorizan los éxitos: st.cache_data no guarda nada si la función lanza,
+    # así un fallo transitorio (p. ej. inicio de Tesseract) no se repite durante una hora.
+    if result["status"] != "PROCESS_OK":
+        raise EvidenceProcessingError(result)
+    return result
+
 def _format_size(size_bytes: int) -> str:
     if size_bytes == 0: return "0B"
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
+    # Exponente base 1024 vía bit_length (sin log/pow en punto flotante)
+    i = min((size_bytes.bit_length() - 1) // 10, 3)
+    p = 1 << (10 * i)
     return f"{round(size_bytes / p, 2)} {('B', 'KB', 'MB', 'GB')[i]}"
 
 # ==========================================
@@ -107,28 +142,27 @@ def main():
             if st.button("⚡ EJECUTAR ANÁLISIS FORENSE", type="primary", use_container_width=True):
                 
                 with st.status("Procesando evidencia...", expanded=True) as status:
-                    # 1. Guardar archivo temporalmente
-                    st.write("💾 Persistiendo archivo en contenedor...")
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-                        tmp_file.write(uploaded_file.getbuffer())
-                        tmp_path = tmp_file.name
-                    
                     try:
-                        # 2. Invocar al Core Processor (Tu lógica real)
+                        # 1. Invocar al Core Processor (Tu lógica real)
                         st.write("🧠 Invocando Red Neuronal / Tesseract OCR...")
                         
                         # Preparamos el payload que espera tu función
+                        # (la imagen viaja en memoria: se decodifica sin pasar por disco)
                         job_payload = {
                             "job_id": f"WEB_{uploaded_file.name}",
-                            "document_path": tmp_path
+                            "document_bytes": uploaded_file.getbuffer()
                         }
                         
                         # ¡AQUÍ OCURRE LA MAGIA!
-                        result = document_full_processor(job_payload)
+                        content_key = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+                        try:
+                            result = process_evidence(content_key, job_payload)
+                        except EvidenceProcessingError as e:
+                            result = e.result  # Se muestra abajo como fallo de procesamiento
                         
                         status.update(label="¡Procesamiento Completado!", state="complete", expanded=False)
                         
-                        # 3. Mostrar Resultados
+                        # 2. Mostrar Resultados
                         if result["status"] == "PROCESS_OK":
                             st.success("✅ Extracción Exitosa")
                             
@@ -152,10 +186,6 @@ def main():
 
                     except Exception as e:
                         st.error(f"Error Crítico en Runtime: {e}")
-                    finally:
-                        # Limpieza
-                        if os.path.exists(tmp_path):
-                            os.remove(tmp_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
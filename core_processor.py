@@ -2,57 +2,232 @@
 CORE_PROCESSOR.PY (Versión Definitiva - Solo Extracción)
 -------------------------------------------------------
 OBJETIVO:
-Extraer 5 datos clave usando Regex sobre imágenes pre-procesadas.
+Extraer 5 datos clave usando Regex sobre imágenes pre-procesadas,
+más el contenido crudo del código QR (si existe).
 Sin validaciones de negocio. Solo datos.
 """
 
+import hashlib
+import json
 import logging
+import multiprocessing as mp
+from multiprocessing import forkserver
+import os
 import re
+import sys
+import threading
 import time
-from typing import Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Optional, List, Tuple
+from urllib.parse import parse_qs, urlsplit
 import cv2
+import diskcache
 import numpy as np
-import pytesseract
-from PIL import Image
+import re2
+import tesserocr
+from pyzbar import pyzbar
 
 # --- CONFIGURACIÓN ---
-TESS_CONFIG: str = "--psm 3 -l spa"
+TESS_LANG: str = "spa"
+TESS_PSM: int = tesserocr.PSM.AUTO  # Equivalente a '--psm 3'
+# Un worker por CPU disponible para este proceso (respeta el cpuset del contenedor).
+MAX_CPU_WORKERS: int = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 4)
+BATCH_SIZE: int = 8         # Documentos por envío al pool (amortiza pickle + ida y vuelta)
+# Módulos que el forkserver importa una sola vez; los workers nacen con ellos ya cargados.
+# tesserocr queda fuera a propósito: cada worker crea su propio TessBaseAPI.
+FORKSERVER_PRELOAD: List[str] = ["numpy", "cv2", "re2", "pyzbar.pyzbar"]
+# Un hilo por librería nativa dentro de cada worker: el paralelismo lo dan los procesos.
+WORKER_THREAD_ENV: Dict[str, str] = {"OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1", "MKL_NUM_THREADS": "1"}
+ZOOM_FACTOR: float = 2.5
+ZOOM_MAX_DIM: int = 2000    # Lado mayor (px) a partir del cual ya no se amplía
+QR_SCAN_SCALE: float = 0.5  # Primer intento de lectura QR a media resolución
+# Caché en disco del texto OCR (clave: SHA-256 de la imagen binarizada + parámetros Tesseract)
+OCR_CACHE_DIR: str = os.getenv("SAF_OCR_CACHE_DIR", "/tmp/saf_ocr_cache")
+OCR_CACHE_TTL: int = 30 * 24 * 3600  # Segundos; cubre cambios de traineddata que la clave no ve
 
 # --- PATRONES DE EXTRACCIÓN ---
-PATTERNS = {
+# Un patrón por campo, cada uno con su propio recorrido del texto: ninguna alternativa
+# puede consumir el texto de otro campo (p. ej. el 'oc' de "Documento" tapando un total).
+# Motor RE2 (autómata, tiempo lineal): sin backtracking ante ruido OCR.
+# RE2 interpreta \s y \d solo en ASCII; Python re (motor original de estos patrones) en Unicode
+# (p. ej. '\v' o '\xa0' son espacio para re). Equivalentes explícitos para no cambiar resultados.
+PY_RE_WHITESPACE: str = r'[\t\n\v\f\r\x1c-\x1f\x85\p{Z}]'
+PY_RE_DIGIT: str = r'\p{Nd}'
+
+def _re2_compile(pattern: str) -> Any:
+    r""" Compila con RE2 dando a \s y \d el alcance Unicode de Python re. """
+    return re2.compile(pattern.replace(r'\s', PY_RE_WHITESPACE).replace(r'\d', PY_RE_DIGIT))
+
+# Grupo 1 = valor a extraer.
+FIELD_PATTERNS: Dict[str, Any] = {
     # 1. UUID (Folio Fiscal)
-    "UUID": r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}',
-    
+    "UUID": _re2_compile(r'([a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12})'),
+
     # 2. RFC Emisor (Cualquier RFC con estructura válida)
-    "RFC_EMISOR": r'[A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3}',
-    
+    "RFC_EMISOR": _re2_compile(r'([A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3})'),
+
     # 3. Orden de Compra (OC/XX/XXXX)
-    "ORDEN_COMPRA": r'(?:OC|ORDEN\s+DE\s+COMPRA|PEDIDO|N°\s+DE\s+ORDEN)[^\d]*(\d{2}[/.-]\d+)',
-    
+    "ORDEN_COMPRA": _re2_compile(r'(?i)(?:OC|ORDEN\s+DE\s+COMPRA|PEDIDO|N°\s+DE\s+ORDEN)[^\d]*(\d{2}[/.-]\d+)'),
+
     # 4. Fecha (ISO o MX)
-    "FECHA": r'(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})',
-    
-    # 5. Total (Moneda)
-    "TOTAL": r'(?:Total|TOTAL|Neto|Pagar|Importe|Gran Total)[^0-9\n]*\$?\s*([\d,]+\.\d{2})'
+    "FECHA": _re2_compile(r'(\d{4}-\d{2}-\d{2}|\d{2}/\d{2}/\d{4})'),
+
+    # 5. Total (Moneda). '[^0-9\n]*' ya cubre '$' y espacios; solo puede cruzar un salto de línea
+    #    al final, así ningún tramo de texto admite más de una forma de repartirse.
+    "TOTAL": _re2_compile(r'(?i)(?:Total|TOTAL|Neto|Pagar|Importe|Gran Total)[^0-9\n]*(?:\n\s*)?([\d,]+\.\d{2})'),
 }
 
+# Parámetros del QR CFDI del SAT (?id=UUID&re=RFC_EMISOR&rr=...&tt=TOTAL&fe=...)
+# -> campo equivalente del escaneo Regex + validación del valor.
+SAT_QR_FIELDS: Dict[str, Tuple[str, re.Pattern]] = {
+    "id": ("UUID", re.compile(r'[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}')),
+    "re": ("RFC_EMISOR", re.compile(r'[A-ZÑ&]{3,4}\d{6}[A-Z0-9]{3}')),
+    "tt": ("TOTAL", re.compile(r'\d+(?:\.\d+)?')),
+}
+
+# Todo lo que no sea dígito o punto decimal en un monto OCR ('$', espacios, comas).
+AMOUNT_NOISE = re.compile(r'[^\d.]')
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("SAF_CORE")
 
-def _preprocess_heavy_duty(image_path: str) -> np.ndarray:
-    """ Limpieza: Zoom 2.5x + Umbral Adaptativo. """
-    img = cv2.imread(image_path)
-    if img is None: raise ValueError("Error leyendo imagen")
+# --- MOTOR TESSERACT EN PROCESO ---
+# Una sola instancia por proceso: el modelo 'spa' se carga una vez y se reutiliza
+# entre documentos (sin fork del binario tesseract por llamada).
+_TESS_API: Optional[tesserocr.PyTessBaseAPI] = None
+_TESS_LOCK = threading.Lock()
+
+def _get_tess_api() -> tesserocr.PyTessBaseAPI:
+    """ Inicialización perezosa de TessBaseAPI. Llamar con _TESS_LOCK adquirido. """
+    global _TESS_API
+    if _TESS_API is None:
+        _TESS_API = tesserocr.PyTessBaseAPI(lang=TESS_LANG, psm=TESS_PSM)
+    return _TESS_API
+
+def _init_worker() -> None:
+    """ Initializer del pool: OpenCV en un solo hilo y TessBaseAPI cargado antes del primer trabajo. """
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(1)
+    with _TESS_LOCK:
+        _get_tess_api()
+
+# --- CACHÉ DE TEXTO OCR ---
+# Plantillas repetidas y re-ingestas producen la misma imagen binarizada: se evita Tesseract.
+# Se abre por proceso (la conexión SQLite de diskcache no debe heredarse por fork).
+# Es solo una optimización: cualquier fallo de la caché se registra y se sigue con Tesseract.
+_OCR_CACHE: Optional[diskcache.Cache] = None
+_OCR_CACHE_DISABLED = False
+_OCR_CACHE_LOCK = threading.Lock()
+# Versión del motor en la clave: tras actualizar Tesseract no se sirve texto del motor anterior.
+_TESS_VERSION: str = tesserocr.tesseract_version().splitlines()[0].strip()
+
+def _get_ocr_cache() -> Optional[diskcache.Cache]:
+    """ Apertura perezosa de la caché OCR del proceso. None si el directorio no es utilizable. """
+    global _OCR_CACHE, _OCR_CACHE_DISABLED
+    with _OCR_CACHE_LOCK:
+        if _OCR_CACHE is None and not _OCR_CACHE_DISABLED:
+            try:
+                _OCR_CACHE = diskcache.Cache(OCR_CACHE_DIR)
+            except Exception as e:
+                _OCR_CACHE_DISABLED = True  # No reintentar en cada documento
+                logger.warning(f"Caché OCR deshabilitada ({OCR_CACHE_DIR}): {e}")
+        return _OCR_CACHE
+
+def _ocr_cache_key(img_bytes: bytes, width: int, height: int) -> str:
+    """ Clave de caché: versión y parámetros del motor + dimensiones + SHA-256 de los píxeles. """
+    digest = hashlib.sha256(img_bytes).hexdigest()
+    return f"{_TESS_VERSION}:{TESS_LANG}:{int(TESS_PSM)}:{width}x{height}:{digest}"
+
+def _ocr_cache_get(key: str) -> Optional[str]:
+    """ Lectura tolerante a fallos: un error de la caché equivale a un fallo de búsqueda. """
+    cache = _get_ocr_cache()
+    if cache is None: return None
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"Caché OCR: lectura fallida: {e}")
+        return None
+
+def _ocr_cache_set(key: str, text: str) -> None:
+    """ Escritura tolerante a fallos (p. ej. 'database is locked' o disco lleno). """
+    cache = _get_ocr_cache()
+    if cache is None: return
+    try:
+        cache.set(key, text, expire=OCR_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Caché OCR: escritura fallida: {e}")
+
+# --- BUFFERS DE TRABAJO ---
+# Un juego por hilo, reutilizado entre documentos (solo crece si llega una imagen mayor).
+# Las vistas devueltas son válidas hasta la siguiente llamada en el mismo hilo.
+_SCRATCH = threading.local()
+
+def _scratch(name: str, shape: Tuple[int, int]) -> np.ndarray:
+    """ Vista 2D uint8 sobre el buffer reutilizable 'name'. """
+    size = shape[0] * shape[1]
+    buf = getattr(_SCRATCH, name, None)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=np.uint8)
+        setattr(_SCRATCH, name, buf)
+    return buf[:size].reshape(shape)
+
+def _load_gray(job_data: Dict[str, Any]) -> np.ndarray:
+    """ Escala de grises directa desde 'document_bytes' (memoria) o 'document_path' (disco). """
+    doc_bytes = job_data.get('document_bytes')
+    if doc_bytes is not None:
+        gray = cv2.imdecode(np.frombuffer(doc_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        gray = cv2.imread(job_data.get('document_path'), cv2.IMREAD_GRAYSCALE)
+    if gray is None: raise ValueError("Error leyendo imagen")
+    return gray
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.resize(gray, None, fx=2.5, fy=2.5, interpolation=cv2.INTER_CUBIC)
-    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 15, 5)
+def _preprocess_heavy_duty(gray: np.ndarray) -> np.ndarray:
+    """ Limpieza: Zoom 2.5x (solo en baja resolución) + Umbral Adaptativo. """
+    h, w = gray.shape[:2]
+    if max(h, w) > ZOOM_MAX_DIM:
+        zoomed = gray
+    else:
+        zoom_shape = (round(h * ZOOM_FACTOR), round(w * ZOOM_FACTOR))
+        zoomed = cv2.resize(gray, None, dst=_scratch("zoomed", zoom_shape),
+                            fx=ZOOM_FACTOR, fy=ZOOM_FACTOR, interpolation=cv2.INTER_LINEAR)
+    binary = cv2.adaptiveThreshold(zoomed, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 15, 5,
+                                   dst=_scratch("binary", zoomed.shape[:2]))
     return binary
 
+def _decode_qr(gray: np.ndarray) -> List[Any]:
+    """ QR sobre grises: primero a media resolución; resolución completa solo si falla. """
+    small = cv2.resize(gray, None, fx=QR_SCAN_SCALE, fy=QR_SCAN_SCALE, interpolation=cv2.INTER_AREA)
+    return pyzbar.decode(small) or pyzbar.decode(gray)
+
+def _parse_sat_qr(qr_data: Optional[str]) -> Dict[str, str]:
+    """ Extrae UUID, RFC emisor y total del QR CFDI. Solo devuelve valores válidos. """
+    if not qr_data: return {}
+    params = parse_qs(urlsplit(qr_data.strip()).query)
+    fields: Dict[str, str] = {}
+    for key, (field, pattern) in SAT_QR_FIELDS.items():
+        value = params.get(key, [""])[0].strip()
+        if pattern.fullmatch(value):
+            fields[field] = value
+    return fields
+
+def _extract_fields(full_text: str, skip: Iterable[str] = ()) -> Dict[str, str]:
+    """ Un recorrido RE2 por campo. Total: última coincidencia. Resto: primera coincidencia. """
+    hits: Dict[str, str] = {}
+    for field, pattern in FIELD_PATTERNS.items():
+        if field in skip: continue
+        if field == "TOTAL":
+            match = None
+            for match in pattern.finditer(full_text): pass
+        else:
+            match = pattern.search(full_text)
+        if match:
+            hits[field] = match.group(1)
+    return hits
+
 def _clean_amount(amount_str: str) -> Optional[float]:
     """ Limpia formato moneda. """
     try:
-        return float(re.sub(r'[^\d.]', '', amount_str.replace(',', '')))
+        return float(AMOUNT_NOISE.sub('', amount_str))
     except:
         return None
 
@@ -64,42 +239,48 @@ def document_full_processor(job_data: Dict[str, Any]) -> Dict[str, Any]:
         "rfc_emisor": None,
         "orden_compra": None,
         "fecha_emision": None,
+        "qr_data": None,
         "error_msg": None
     }
 
     try:
-        doc_path = job_data.get('document_path')
-        
-        # 1. OCR
-        processed_img = _preprocess_heavy_duty(doc_path)
-        full_text = pytesseract.image_to_string(Image.fromarray(processed_img), config=TESS_CONFIG)
-
-        # 2. Extracción Regex
-        
-        # UUID
-        match_uuid = re.search(PATTERNS["UUID"], full_text, re.IGNORECASE)
-        if match_uuid: 
-            response["ocr_folio_fiscal"] = match_uuid.group(0).upper()
-
-        # Total (Última coincidencia)
-        matches_total = re.findall(PATTERNS["TOTAL"], full_text, re.IGNORECASE)
-        if matches_total:
-            response["ocr_total"] = str(_clean_amount(matches_total[-1]))
-
-        # Orden de Compra
-        match_oc = re.search(PATTERNS["ORDEN_COMPRA"], full_text, re.IGNORECASE)
-        if match_oc:
-            response["orden_compra"] = match_oc.group(1)
-
-        # Fecha
-        match_fecha = re.search(PATTERNS["FECHA"], full_text)
-        if match_fecha:
-            response["fecha_emision"] = match_fecha.group(1)
-
-        # RFC Emisor (Tomamos el primero que encuentre)
-        match_rfc = re.search(PATTERNS["RFC_EMISOR"], full_text)
-        if match_rfc:
-            response["rfc_emisor"] = match_rfc.group(0)
+        gray = _load_gray(job_data)
+
+        # 1. QR (sobre la imagen en grises ya cargada). Es opcional: un fallo del lector
+        #    o un contenido no UTF-8 no debe costar los campos OCR; qr_data queda en None.
+        try:
+            barcodes = _decode_qr(gray)
+            response["qr_data"] = next((b.data.decode('utf-8', errors='replace') for b in barcodes if b.data), None)
+        except Exception as e:
+            logger.warning(f"QR ilegible, se continúa solo con OCR: {e}")
+
+        # 2. OCR
+        processed_img = _preprocess_heavy_duty(gray)
+        height, width = processed_img.shape[:2]
+        img_bytes = processed_img.tobytes()
+        cache_key = _ocr_cache_key(img_bytes, width, height)
+        full_text = _ocr_cache_get(cache_key)
+        if full_text is None:
+            with _TESS_LOCK:
+                api = _get_tess_api()
+                # Bytes crudos 8-bit (1 byte/píxel): sin conversión a PIL ni codificación PNG
+                api.SetImageBytes(img_bytes, width, height, 1, width)
+                full_text = api.GetUTF8Text()
+            _ocr_cache_set(cache_key, full_text)
+
+        # 3. Extracción Regex. Lo que trae el QR no se busca en el texto:
+        #    el QR es fuente exacta; OC y fecha no viajan en él y siempre salen del OCR.
+        qr_fields = _parse_sat_qr(response["qr_data"])
+        hits = _extract_fields(full_text, skip=qr_fields.keys())
+        hits.update(qr_fields)
+
+        if "UUID" in hits:
+            response["ocr_folio_fiscal"] = hits["UUID"].upper()
+        if "TOTAL" in hits:
+            response["ocr_total"] = str(_clean_amount(hits["TOTAL"]))
+        response["orden_compra"] = hits.get("ORDEN_COMPRA")
+        response["fecha_emision"] = hits.get("FECHA")
+        response["rfc_emisor"] = hits.get("RFC_EMISOR")
 
         response["status"] = "PROCESS_OK"
 
@@ -107,4 +288,66 @@ def document_full_processor(job_data: Dict[str, Any]) -> Dict[str, Any]:
         response["error_msg"] = str(e)
         logger.error(f"Error OCR: {e}")
 
-    return response
\ No newline at end of file
+    return response
+
+def _prefetch(job_data: Dict[str, Any]) -> Dict[str, Any]:
+    """ Carga el archivo a memoria ('document_bytes') para decodificarlo sin volver a disco. """
+    doc_path = job_data.get('document_path')
+    if job_data.get('document_bytes') is not None or not doc_path:
+        return job_data
+    try:
+        with open(doc_path, 'rb') as fh:
+            return {**job_data, 'document_bytes': fh.read()}
+    except OSError:
+        return job_data  # document_full_processor reporta el fallo de lectura
+
+def document_batch_processor(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ Procesa varios documentos seguidos dentro del mismo worker.
+    La lectura del siguiente archivo se solapa con el OCR del actual. """
+    results: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(_prefetch, jobs[0]) if jobs else None
+        for i in range(len(jobs)):
+            job = pending.result()
+            pending = reader.submit(_prefetch, jobs[i + 1]) if i + 1 < len(jobs) else None
+            results.append(document_full_processor(job))
+    return results
+
+def _start_forkserver() -> None:
+    """ Arranca el forkserver con WORKER_THREAD_ENV y restaura el entorno del llamador.
+    Los workers nacen del forkserver y heredan su entorno; el proceso que llama a
+    main_processor no queda modificado. Solo cuenta el primer arranque por proceso:
+    si el forkserver ya corría, conserva el entorno con el que se inició. """
+    saved = {var: os.environ.get(var) for var in WORKER_THREAD_ENV}
+    for var, value in WORKER_THREAD_ENV.items():
+        os.environ.setdefault(var, value)  # Un valor explícito del usuario se respeta
+    try:
+        forkserver.ensure_running()
+    finally:
+        for var, value in saved.items():
+            if value is None: os.environ.pop(var, None)
+            else: os.environ[var] = value
+
+def main_processor(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ Procesa un lote de trabajos en paralelo (un TessBaseAPI persistente por worker). """
+    if not jobs: return []
+
+    # Lotes de hasta BATCH_SIZE, sin dejar workers ociosos cuando hay pocos documentos.
+    size = min(BATCH_SIZE, -(-len(jobs) // MAX_CPU_WORKERS))
+    batches = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+    ctx = mp.get_context("forkserver")
+    ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+    # OpenMP (Tesseract) lee estas variables al cargarse: deben existir al arrancar el forkserver
+    _start_forkserver()
+
+    with ProcessPoolExecutor(max_workers=MAX_CPU_WORKERS, mp_context=ctx, initializer=_init_worker) as executor:
+        return [result for batch in executor.map(document_batch_processor, batches) for result in batch]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Uso: python core_processor.py <imagen> [<imagen> ...]")
+
+    jobs = [{"job_id": f"CLI_{path}", "document_path": path} for path in sys.argv[1:]]
+    for job, result in zip(jobs, main_processor(jobs)):
+        print(json.dumps({"job_id": job["job_id"], **result}, ensure_ascii=False))
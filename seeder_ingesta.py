@@ -1,11 +1,12 @@
 import os
 import sys
 import hashlib
+import itertools
 import logging
 import pandas as pd
 import numpy as np
 from dataclasses import dataclass
-from typing import List, Final
+from typing import Any, Dict, Final, Iterable, Iterator, List, Set, Tuple
 
 # Verificación de dependencias
 try:
@@ -37,6 +38,12 @@ NUMERIC_COLUMNS: Final[List[str]] = ['cantidad', 'precio_unitario', 'importe']
 CSV_FILENAME: Final[str] = 'Datos_Entradas.csv'
 TARGET_TABLE: Final[str] = 'tbl_entradas_raw'
 
+# Fila lista para COPY: valores en COLUMNS_ORDER + registro_hash
+Row = Tuple[Any, ...]
+
+# Filas por bloque de lectura del CSV (acota la memoria pico)
+CHUNK_SIZE: Final[int] = 100_000
+
 # --- CONFIGURACIÓN BD ---
 @dataclass(frozen=True)
 class DBConfig:
@@ -52,25 +59,78 @@ class DBConfig:
 
 # --- LÓGICA DE NEGOCIO ---
 
-def load_and_transform_data(filepath: str) -> pd.DataFrame:
+def load_and_transform_data(filepath: str) -> Iterator[List[Row]]:
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"El archivo {filepath} no existe.")
 
     logger.info(f"Cargando archivo: {filepath}...")
     
     # 1. Leer todo como String inicialmente para no perder formatos
+    # Lectura por bloques: la memoria queda acotada a CHUNK_SIZE filas, no al archivo.
     try:
-        df = pd.read_csv(filepath, dtype=str, usecols=COLUMNS_ORDER)
+        numeric_dtypes = _infer_numeric_dtypes(filepath)
+        reader = pd.read_csv(filepath, dtype=str, usecols=COLUMNS_ORDER, chunksize=CHUNK_SIZE)
     except ValueError as e:
         logger.error("Error estructural en CSV.")
         raise e
 
-    # 2. Eliminar duplicados exactos
-    registros_iniciales = len(df)
-    df.drop_duplicates(subset=COLUMNS_ORDER, keep='first', inplace=True)
-    if len(df) != registros_iniciales:
-        logger.warning(f"Se eliminaron {registros_iniciales - len(df)} duplicados.")
-    
+    return _iter_transformed_chunks(reader, numeric_dtypes)
+
+def _infer_numeric_dtypes(filepath: str) -> Dict[str, np.dtype]:
+    # Pre-pasada ligera (solo NUMERIC_COLUMNS): dtype que to_numeric daría sobre el archivo
+    # completo. Por bloque, uno sin vacíos ni decimales saldría int64 ("3") y otro float64
+    # ("3.0"): registro_hash dependería de dónde cae el corte de bloque.
+    dtypes: Dict[str, np.dtype] = {}
+    with pd.read_csv(filepath, dtype=str, usecols=NUMERIC_COLUMNS, chunksize=CHUNK_SIZE) as reader:
+        for df in reader:
+            for col in NUMERIC_COLUMNS:
+                dtype = pd.to_numeric(df[col], errors='coerce').dtype
+                dtypes[col] = np.result_type(dtypes[col], dtype) if col in dtypes else dtype
+    return dtypes
+
+def _iter_transformed_chunks(reader: Iterable[pd.DataFrame], numeric_dtypes: Dict[str, np.dtype]) -> Iterator[List[Row]]:
+    # Filas crudas ya emitidas: deduplicación global entre bloques
+    seen_rows: Set[bytes] = set()
+    registros_iniciales = 0
+    registros_emitidos = 0
+
+    with reader:
+        for df in reader:
+            registros_iniciales += len(df)
+
+            # 2. Eliminar duplicados exactos (mismos valores crudos del CSV, dentro del bloque
+            #    y contra bloques anteriores). No se usa registro_hash: filas distintas pueden
+            #    compartirlo (p. ej. '3269' y '3269.0') y deben llegar al índice único.
+            raw_keys = _raw_row_keys(df)
+            rows = transform_chunk(df, numeric_dtypes)
+            del df
+
+            unique_rows = []
+            for key, row in zip(raw_keys, rows):
+                if key not in seen_rows:
+                    seen_rows.add(key)
+                    unique_rows.append(row)
+
+            registros_emitidos += len(unique_rows)
+            logger.info(f"Bloque transformado. Registros acumulados: {registros_emitidos}")
+            yield unique_rows
+
+    if registros_emitidos != registros_iniciales:
+        logger.warning(f"Se eliminaron {registros_iniciales - registros_emitidos} duplicados.")
+    logger.info(f"Transformación lista. Registros a insertar: {registros_emitidos}")
+
+def _raw_row_keys(df: pd.DataFrame) -> List[bytes]:
+    # Llave de deduplicación por fila sobre los strings crudos del CSV.
+    # repr() de la tupla es inyectivo (sin ambigüedad entre columnas; un vacío llega como
+    # float nan, cuyo repr no coincide con ningún string); el digest de 16 bytes mantiene
+    # acotada la memoria del set global.
+    blake2b = hashlib.blake2b  # Enlace local: evita la búsqueda del atributo en cada fila
+    return [
+        blake2b(repr(row).encode('utf-8'), digest_size=16).digest()
+        for row in zip(*[df[col].tolist() for col in COLUMNS_ORDER])
+    ]
+
+def transform_chunk(df: pd.DataFrame, numeric_dtypes: Dict[str, np.dtype]) -> Iterator[Row]:
     # *** CORRECCIÓN MAESTRA DE TIPOS (V5) ***
     
     # A. Limpieza de Columnas ENTERAS (INTEGER)
@@ -80,30 +140,39 @@ def load_and_transform_data(filepath: str) -> pd.DataFrame:
         df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int64')
 
     # B. Limpieza de Columnas DECIMALES (NUMERIC)
-    # Aquí los flotantes están permitidos.
+    # Aquí los flotantes están permitidos. Se fija el dtype del archivo completo (ver
+    # _infer_numeric_dtypes) para que el hash no dependa del bloque.
     for col in NUMERIC_COLUMNS:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype(numeric_dtypes[col])
 
     # C. Estandarización de Nulos para PostgreSQL
     # Convertimos pd.NA (de Int64), np.nan (de float) y None a un objeto None nativo de Python.
     # Esto es CRÍTICO para que psycopg envíe NULL y no 'NaN' o 'nan'.
-    df = df.astype(object).where(pd.notnull(df), None)
-
-    logger.info("Calculando Hash SHA-256...")
+    # Se hace por columna sobre listas planas, sin materializar un DataFrame object.
+    py_columns = [
+        [None if na else val for val, na in zip(df[col].tolist(), df[col].isna().tolist())]
+        for col in COLUMNS_ORDER
+    ]
 
     # 3. Hash Vectorizado sobre los datos limpios
-    # Nota: Usamos str(val) para que 3269 sea "3269" y None sea "" (cadena vacía)
-    subset_df = df[COLUMNS_ORDER]
+    # Nota: Usamos str(val) para que 3269 sea "3269" y None sea "" (cadena vacía).
+    # Se serializa columna por columna (una pasada plana por columna); por fila solo
+    # queda concatenar y hashear.
+    str_columns = [
+        ['' if val is None else str(val) for val in values]
+        for values in py_columns
+    ]
+    sha256 = hashlib.sha256  # Enlace local: evita la búsqueda del atributo en cada fila
     hashes = [
-        hashlib.sha256("".join(str(val) if val is not None else '' for val in row).encode('utf-8')).hexdigest()
-        for row in subset_df.itertuples(index=False, name=None)
+        sha256("".join(row).encode('utf-8')).hexdigest()
+        for row in zip(*str_columns)
     ]
-    df['registro_hash'] = hashes
-    
-    logger.info(f"Transformación lista. Registros a insertar: {len(df)}")
-    return df
+    del str_columns
+
+    # Filas listas para COPY (perezosas): columnas en COLUMNS_ORDER + registro_hash
+    return zip(*py_columns, hashes)
 
-def execute_bulk_copy(df: pd.DataFrame, config: DBConfig) -> None:
+def execute_bulk_copy(chunks: Iterable[List[Row]], config: DBConfig) -> int:
     conn_str = config.conn_string
     final_columns = COLUMNS_ORDER + ['registro_hash']
     
@@ -114,14 +183,20 @@ def execute_bulk_copy(df: pd.DataFrame, config: DBConfig) -> None:
 
     logger.info(f"Conectando a PostgreSQL...")
     try:
+        total = 0
         with psycopg.connect(conn_str) as conn:
             with conn.cursor() as cur:
                 logger.info("Iniciando carga masiva (COPY)...")
+                # El COPY se abre antes de leer: cada bloque se transforma y se envía
+                # mientras PostgreSQL procesa el anterior.
                 with cur.copy(copy_sql) as copy_stream:
-                    for row in df[final_columns].itertuples(index=False, name=None):
-                        copy_stream.write_row(row)
+                    for rows in chunks:
+                        for row in rows:
+                            copy_stream.write_row(row)
+                        total += len(rows)
             conn.commit()
-            logger.info("✅ Transacción confirmada EXITOSAMENTE.")
+            logger.info(f"✅ Transacción confirmada EXITOSAMENTE ({total} registros).")
+        return total
 
     except psycopg.Error as db_err:
         logger.critical(f"Error DB: {db_err}")
@@ -133,9 +208,11 @@ def execute_bulk_copy(df: pd.DataFrame, config: DBConfig) -> None:
 def main():
     try:
         config = DBConfig()
-        df = load_and_transform_data(CSV_FILENAME)
-        if df.empty: sys.exit(0)
-        execute_bulk_copy(df, config)
+        chunks = load_and_transform_data(CSV_FILENAME)
+        # Primer bloque con filas antes de conectar: sin registros no se toca la BD
+        first = next((rows for rows in chunks if rows), None)
+        if first is None: sys.exit(0)
+        execute_bulk_copy(itertools.chain([first], chunks), config)
         print("\n=== ✨ PROCESO FINALIZADO CON ÉXITO ✨ ===\n")
     except Exception as e:
         logger.critical(f"Fallo: {e}")
@@ -10,11 +10,13 @@ Autor: SAF-SYNTH-LEAD
 Estándar: Python 3.12+ (Type Hinting, PEP 8)
 """
 
+import os
 import sys
 import logging
 import re
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 # Verificación defensiva de dependencias
 try:
@@ -31,6 +33,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger("OCR_Engine")
 
+# Configuración de parámetros Tesseract (compartida por modo individual y por lote)
+TESS_CONFIG: str = r'--psm 7 -l spa'
+
+# Imágenes por invocación en modo lote (Tesseract puede colgarse con listas de >50)
+BATCH_CHUNK_SIZE: int = 40
+
+# Secuencias de espacios en blanco (\n, \t, \r, espacios múltiples)
+WHITESPACE_RUN = re.compile(r'\s+')
+
 def clean_ocr_text(raw_text: str) -> str:
     """
     Sanitiza la salida del OCR eliminando caracteres de control y normalizando espacios.
@@ -45,7 +56,7 @@ def clean_ocr_text(raw_text: str) -> str:
     if not raw_text:
         return ""
     # Regex: Reemplaza \n, \t, \r y espacios múltiples por un solo espacio
-    cleaned = re.sub(r'\s+', ' ', raw_text)
+    cleaned = WHITESPACE_RUN.sub(' ', raw_text)
     return cleaned.strip()
 
 def run_ocr(image_path: str) -> Optional[str]:
@@ -76,9 +87,6 @@ def run_ocr(image_path: str) -> Optional[str]:
 
     logger.info(f"Procesando imagen: {target_path.name}")
 
-    # Configuración de parámetros Tesseract
-    tess_config = r'--psm 7 -l spa'
-
     try:
         # 2. Gestión Segura de Memoria (Context Manager)
         # CRÍTICO: 'with' garantiza el cierre del file descriptor tras la lectura.
@@ -88,7 +96,7 @@ def run_ocr(image_path: str) -> Optional[str]:
             img.load() 
             
             # 3. Ejecución del Motor OCR
-            raw_text = pytesseract.image_to_string(img, config=tess_config)
+            raw_text = pytesseract.image_to_string(img, config=TESS_CONFIG)
             
             # 4. Limpieza de Datos
             final_text = clean_ocr_text(raw_text)
@@ -107,9 +115,83 @@ def run_ocr(image_path: str) -> Optional[str]:
 
     return None
 
+def _ocr_list_file(image_paths: List[Path]) -> Optional[List[str]]:
+    """
+    Una sola invocación de Tesseract sobre un archivo-lista (una ruta por línea).
+    El binario inicializa el modelo una vez y separa cada página con '\\f'.
+
+    Returns:
+        Optional[List[str]]: Texto crudo por imagen (mismo orden), o None si la
+        salida no puede mapearse 1:1 con las imágenes de entrada.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', prefix='saf_ocr_', delete=False) as list_file:
+        list_file.write("\n".join(str(path) for path in image_paths) + "\n")
+    try:
+        raw_text = pytesseract.image_to_string(list_file.name, config=TESS_CONFIG)
+    finally:
+        os.remove(list_file.name)
+
+    pages = raw_text.split('\f')
+    # Tesseract 4.x agrega el separador tras cada página (queda un sobrante vacío al final)
+    if len(pages) == len(image_paths) + 1 and not pages[-1].strip():
+        pages.pop()
+    return pages if len(pages) == len(image_paths) else None
+
+def run_ocr_batch(image_paths: List[str]) -> List[Optional[str]]:
+    """
+    Ejecuta OCR sobre varias imágenes con una invocación de Tesseract por bloque
+    de BATCH_CHUNK_SIZE, en lugar de un proceso (y una carga del modelo) por imagen.
+
+    Args:
+        image_paths (List[str]): Rutas a los archivos de imagen.
+
+    Returns:
+        List[Optional[str]]: Texto limpio por imagen (mismo orden que la entrada);
+        None en las posiciones cuya lectura falló.
+    """
+    results: List[Optional[str]] = [None] * len(image_paths)
+
+    # 1. Validación de Entrada (las rutas inválidas quedan en None)
+    valid: List[Tuple[int, Path]] = []
+    for idx, image_path in enumerate(image_paths):
+        target_path = Path(image_path).expanduser().resolve()
+        if target_path.is_file():
+            valid.append((idx, target_path))
+        else:
+            logger.error(f"La ruta no apunta a un archivo válido: {target_path}")
+
+    # 2. Ejecución del Motor OCR por bloques
+    for start in range(0, len(valid), BATCH_CHUNK_SIZE):
+        chunk = valid[start:start + BATCH_CHUNK_SIZE]
+        logger.info(f"Procesando lote de {len(chunk)} imágenes...")
+        try:
+            pages = _ocr_list_file([path for _, path in chunk])
+        except pytesseract.TesseractNotFoundError:
+            logger.critical("Entorno Error: Binario de Tesseract no encontrado. Verifique instalación y PATH.")
+            return results
+        except pytesseract.TesseractError as e:
+            logger.error(f"Motor Error: Fallo interno de Tesseract - {e}")
+            pages = None
+
+        if pages is None:
+            # Respaldo: el lote no pudo mapearse 1:1, se procesa imagen por imagen
+            logger.warning("Salida de lote inconsistente. Reintentando imagen por imagen...")
+            for idx, path in chunk:
+                results[idx] = run_ocr(str(path))
+            continue
+
+        # 3. Limpieza de Datos
+        for (idx, _), page in zip(chunk, pages):
+            results[idx] = clean_ocr_text(page)
+
+    return results
+
 def main():
     """
     Orquestador principal del script.
+
+    Sin argumentos procesa la imagen de diagnóstico por defecto; con varias rutas
+    en línea de comandos las procesa en lote (run_ocr_batch).
     """
     # Ruta definida por la arquitectura del proyecto SAF-GDA
     TARGET_IMAGE = "~/saf_gda/vision_lab/salida_debug/test_factura_ocr_ready.png"
@@ -118,8 +200,23 @@ def main():
     print("SAF-GDA: VISION LAB - TESSERACT DIAGNOSTIC TOOL")
     print("=" * 60)
 
+    image_paths = sys.argv[1:] or [TARGET_IMAGE]
+    if len(image_paths) > 1:
+        # Modo lote: una invocación de Tesseract por bloque de imágenes
+        results = run_ocr_batch(image_paths)
+        print("-" * 60)
+        for image_path, text in zip(image_paths, results):
+            print(f"{image_path}: " + (f"'{text}'" if text is not None else "FALLO"))
+        print("-" * 60)
+        failures = sum(text is None for text in results)
+        if failures:
+            print(f"FALLO CRÍTICO: {failures} de {len(results)} imágenes sin texto.")
+            sys.exit(1)
+        print("Ejecución finalizada correctamente.")
+        sys.exit(0)
+
     # Ejecución del Pipeline
-    extracted_text = run_ocr(TARGET_IMAGE)
+    extracted_text = run_ocr(image_paths[0])
 
     print("-" * 60)
     